@@ -1,34 +1,217 @@
 import math
-import multiprocessing
 import random
 import threading
-from typing import List, Tuple
+from typing import List, Optional, Tuple, Union
+import numba
 import numpy as np
+import matplotlib
+# The plots are only saved, so no interactive backend is needed
+matplotlib.use('Agg')
 from matplotlib import pyplot as plt
 
 
-def count_elements(database: List[int], m: int) -> Tuple[int, int]:
+# Generator for the step by step noise, which is much cheaper per sample than NumPy.
+# It is shared by all parties, so creating a party does not pay for seeding a new one.
+_RNG = random.Random()
+
+
+def sample_noise(rng: np.random.Generator, size: Tuple[int, ...], noise_prob: float, use_laplace: bool,
+                 laplace_scale: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Draw a batch of noise for the counts L and G at once.
+
+    Args:
+        rng: The random number generator to draw from.
+        size: The shape of the batch, e.g. (iterations, steps, databases).
+        noise_prob: Probability to add noise. An array broadcastable to size draws each part with its own probability.
+        use_laplace: If to use laplace for noise. If false, a uniform noise is used.
+        laplace_scale: Scale for laplace
+
+    Returns:
+        A tuple (noise_l, noise_g) where noise_l is added to L and noise_g is subtracted from G.
+    """
+    if use_laplace:
+        # The difference of two exponential samples is Laplace distributed, which is faster to draw than rng.laplace
+        exponential = rng.standard_exponential((2, *size))
+        laplace_noise = (noise_prob * laplace_scale) * (exponential[0] - exponential[1])
+        return laplace_noise, laplace_noise
+
+    add_noise = rng.random(size) < noise_prob
+    noise_l = rng.integers(-1, 2, size=size) * add_noise
+    noise_g = rng.integers(-1, 2, size=size) * add_noise
+    return noise_l, noise_g
+
+
+@numba.njit(cache=True)
+def count_elements(database: np.ndarray, m: int) -> Tuple[int, int]:
     """
     Count elements in the database which are lesser than or greater than m.
 
+    Both counts are taken in a single pass without branches, so the database does not need to be sorted.
+
     Args:
-        database: The list of integers to analyze.
+        database: The array of integers to analyze.
         m: The pivot element to compare others against.
 
     Returns:
         A tuple (L, G) where L is the count of elements less than m and G is the count of elements greater than m.
     """
-    L = sum(i < m for i in database)
-    G = sum(i > m for i in database)
+    L, G = 0, 0
+    for i in database:
+        L += i < m
+        G += i > m
     return L, G
 
 
+def to_db_matrix(databases: List[List[int]]) -> np.ndarray:
+    """
+    Stack the databases into a single contiguous matrix, which can be handed to the compiled search.
+
+    Args:
+        databases: List of lists, where each list is a database of integers. All databases need the same size.
+
+    Returns:
+        A matrix of shape (databases, db_size) where row j holds database j sorted.
+    """
+    assert len(set(len(db) for db in databases)) == 1, "All databases need the same size"
+    db_matrix = np.array(databases, dtype=np.int32)
+    db_matrix.sort(axis=1)
+    return db_matrix
+
+
+def _as_db_matrix(databases: Union[List[List[int]], np.ndarray], validate: bool = True) -> np.ndarray:
+    """
+    Use a matrix from to_db_matrix as it is, or stack the databases into one.
+
+    Args:
+        databases: List of lists, where each list is a database of integers, or a matrix from to_db_matrix.
+        validate: If to check that a given matrix has sorted rows. Skip it only for a matrix already checked.
+
+    Returns:
+        A matrix of shape (databases, db_size) where row j holds database j sorted.
+    """
+    if not isinstance(databases, np.ndarray):
+        return to_db_matrix(databases)
+    # The compiled search looks up the counts with a binary search, which needs sorted rows
+    if validate:
+        assert databases.ndim == 2 and (np.diff(databases, axis=1) >= 0).all(), \
+            "Use to_db_matrix to sort the databases"
+    return databases
+
+
+@numba.njit(cache=True)
+def _find_k_numba(db_matrix, k, a, b, noise_l, noise_g, noise_prob, laplace_scale, use_laplace):
+    """
+    Compiled version of CentralParty.find_k.
+
+    Args:
+        db_matrix: The sorted databases, see to_db_matrix.
+        k: An integer to define the element to find.
+        a: The minimum element among all databases.
+        b: The maximum element among all databases.
+        noise_l: Pre-sampled noise for L of shape (steps, databases).
+        noise_g: Pre-sampled noise for G of shape (steps, databases).
+        noise_prob: Probability to add noise, used once the pre-sampled noise is exhausted.
+        laplace_scale: Scale for laplace, used once the pre-sampled noise is exhausted.
+        use_laplace: If to use laplace for noise, used once the pre-sampled noise is exhausted.
+
+    Returns:
+        A tuple (m, steps) where m is the kth element and steps is the number of steps taken to find it.
+    """
+    n_dbs, db_size = db_matrix.shape
+    N = n_dbs * db_size
+    steps = 0
+    while True:
+        m = (a + b) // 2
+        steps += 1
+
+        L, G = 0, 0
+        for j in range(n_dbs):
+            l = np.searchsorted(db_matrix[j], m, side='left')
+            g = db_size - np.searchsorted(db_matrix[j], m, side='right')
+
+            if steps <= noise_l.shape[0]:
+                l_noise = float(noise_l[steps - 1, j])
+                g_noise = float(noise_g[steps - 1, j])
+            elif use_laplace:
+                l_noise = np.random.laplace(0.0, noise_prob * laplace_scale)
+                g_noise = l_noise
+            elif np.random.random() <= noise_prob:
+                l_noise = float(np.random.randint(-1, 2))
+                g_noise = float(np.random.randint(-1, 2))
+            else:
+                l_noise, g_noise = 0.0, 0.0
+            L += max(int(l + l_noise), 0)
+            G += max(int(g - g_noise), 0)
+
+        if L < k and G <= N - k:
+            return m, steps
+        elif L >= k:
+            b = m - 1
+        else:
+            a = m + 1
+
+
+@numba.njit(parallel=True, cache=True)
+def run_sweep(db_matrix, k, a, b, noise_probs, laplace_scale, use_laplace, noise_l, noise_g):
+    """
+    Run the compiled search for all probabilities and iterations, spread over all cores.
+
+    Args:
+        db_matrix: The sorted databases, see to_db_matrix.
+        k: An integer to define the element to find.
+        a: The minimum element among all databases.
+        b: The maximum element among all databases.
+        noise_probs: Probability to add noise for each step of the resolution.
+        laplace_scale: Scale for laplace
+        use_laplace: If to use laplace for noise
+        noise_l: Pre-sampled noise for L of shape (resolution, iterations, steps, databases).
+        noise_g: Pre-sampled noise for G of shape (resolution, iterations, steps, databases).
+
+    Returns:
+        A tuple (min_values, steps_needed) of shape (resolution, iterations) with the result and number of steps
+        of each run.
+    """
+    resolution, iterations = noise_l.shape[0], noise_l.shape[1]
+    min_values = np.empty((resolution, iterations), dtype=np.int32)
+    steps_needed = np.empty((resolution, iterations), dtype=np.int32)
+    for i in numba.prange(resolution):
+        for j in range(iterations):
+            m, steps = _find_k_numba(db_matrix, k, a, b, noise_l[i, j], noise_g[i, j], noise_probs[i],
+                                     laplace_scale, use_laplace)
+            min_values[i, j] = m
+            steps_needed[i, j] = steps
+    return min_values, steps_needed
+
+
+@numba.njit(cache=True)
+def mean_abs_deviation(values, reference):
+    """
+    Compute the mean absolute deviation from the reference for each row, in a single pass without temporaries.
+
+    Args:
+        values: A matrix of shape (rows, n).
+        reference: The value to compare against.
+
+    Returns:
+        An array of shape (rows,) with the mean absolute deviation of each row.
+    """
+    rows, n = values.shape
+    result = np.empty(rows)
+    for i in range(rows):
+        total = 0.0
+        for x in values[i]:
+            total += abs(x - reference)
+        result[i] = total / n
+    return result
+
+
 class CentralParty:
     """
     A class representing the central party responsible for finding the minimum.
 
     Attributes:
-        databases: List of lists, where each list is a database of integers.
+        db_matrix: The sorted databases stacked into a matrix, see to_db_matrix.
         k: An integer to define the element to find.
         a: The minimum element among all databases.
         b: The maximum element among all databases.
@@ -38,45 +221,74 @@ class CentralParty:
         max_laplace_scale: The maximum scale for the Laplace noise.
     """
 
-    def __init__(self, databases: List[List[int]], k: int, use_laplace: bool = False, max_laplace_scale: float = 1.0):
-        self.databases = databases
+    __slots__ = ('db_matrix', 'k', 'a', 'b', 'N', 'i', 'use_laplace', 'max_laplace_scale', '_a0', '_b0')
+
+    def __init__(self, databases: Union[List[List[int]], np.ndarray], k: int, use_laplace: bool = False,
+                 max_laplace_scale: float = 1.0, a: Optional[int] = None, b: Optional[int] = None):
+        # Keep the databases sorted, so the counts can be looked up with a binary search.
+        # A matrix from to_db_matrix and its bounds can be passed in to reuse them across many parties,
+        # then the matrix is taken as prepared and only stored, without checking it again.
+        self.db_matrix = _as_db_matrix(databases, validate=a is None or b is None)
         self.k = k
-        self.a = min(min(db) for db in databases)
-        self.b = max(max(db) for db in databases)
-        self.N = len(databases[0]) * len(databases)
+        self.a = int(self.db_matrix.min()) if a is None else a
+        self.b = int(self.db_matrix.max()) if b is None else b
+        # Initial bounds, to start another search with reset
+        self._a0, self._b0 = self.a, self.b
+        self.N = self.db_matrix.size
         self.i = 0
         self.use_laplace = use_laplace
         self.max_laplace_scale = max_laplace_scale
 
-    def find_k(self, noise_prob):
+    def reset(self):
+        """
+        Reset the bounds and the step counter, so the same party can run another search.
+        """
+        self.a = self._a0
+        self.b = self._b0
+        self.i = 0
+
+    def find_k(self, noise_prob, noise: Optional[Tuple[np.ndarray, np.ndarray]] = None):
         """
         Find the kth element across all databases.
 
         Args:
             noise_prob: Probability to add noise.
-            use_laplace: If we want to use laplace or uniform
+            noise: Optional pre-sampled noise (noise_l, noise_g) of shape (steps, databases), see sample_noise.
+                If given, the search runs compiled and only draws noise itself once the pre-sampled noise is
+                exhausted. Otherwise, the noise is drawn step by step.
 
         Returns:
             A tuple (m, i) where m is the minimum value and i is the number of steps taken to find it.
         """
+        if noise is not None:
+            m, steps = _find_k_numba(self.db_matrix, self.k, self.a, self.b, noise[0], noise[1],
+                                     noise_prob, self.max_laplace_scale, self.use_laplace)
+            self.i += steps
+            return m, self.i
+
         while True:
             m = math.floor((self.a + self.b) / 2)
             self.i += 1
 
             L, G = 0, 0
-            for db in self.databases:
+            for db in self.db_matrix:
                 l, g = count_elements(db, m)
 
                 if self.use_laplace:
-                    l, g = count_elements(db, m)
-                    # Draw a sample from the Laplace distribution
-                    laplace_noise = np.random.laplace(scale=noise_prob * self.max_laplace_scale)
+                    # Draw a sample from the Laplace distribution, as an exponential sample with a random sign
+                    laplace_noise = -noise_prob * self.max_laplace_scale * math.log(1.0 - _RNG.random())
+                    if _RNG.getrandbits(1):
+                        laplace_noise = -laplace_noise
                     l = max(int(l + laplace_noise), 0)
                     g = max(int(g - laplace_noise), 0)
                 else:
-                    if not (random.random() > noise_prob):
-                        l = max(l + random.randint(-1, 1), 0)
-                        g = max(g - random.randint(-1, 1), 0)
+                    if not (_RNG.random() > noise_prob):
+                        # Both noise values in {-1, 0, 1} at once, from 9 equally likely values out of 4 random bits
+                        r = _RNG.getrandbits(4)
+                        while r >= 9:
+                            r = _RNG.getrandbits(4)
+                        l = max(l + r // 3 - 1, 0)
+                        g = max(g - (r % 3 - 1), 0)
                 L += l
                 G += g
 
@@ -99,17 +311,14 @@ def kth_element(databases: List[List[int]], k: int) -> int:
     Returns:
         The kth element across all databases.
     """
-    # Flatten the list of databases into a single list
-    flat_list = [item for sublist in databases for item in sublist]
+    # Flatten the databases into a single array
+    flat = np.concatenate([np.asarray(db, dtype=np.int32) for db in databases])
 
-    # Sort the list
-    sorted_list = sorted(flat_list)
+    # Select the kth element without sorting the whole array
+    return int(np.partition(flat, k - 1)[k - 1])
 
-    # Find and return the kth element
-    return sorted_list[k - 1]
 
-
-def plot_data(k, iterations_per_probability, resolution, databases, use_laplace, laplace_scale):
+def plot_data(k, iterations_per_probability, resolution, databases, use_laplace, laplace_scale, ax1=None, ax2=None):
     """
     Plot the data for average deviation and average iterations needed.
 
@@ -117,41 +326,55 @@ def plot_data(k, iterations_per_probability, resolution, databases, use_laplace,
         k: An integer to define the element to find.
         iterations_per_probability: The number of iterations for each probability.
         resolution: The resolution for the range of probabilities.
-        databases: List of lists, where each list is a database of integers.
+        databases: List of lists, where each list is a database of integers, or a matrix from to_db_matrix.
         use_laplace: If to use laplace for noise
         laplace_scale: Scale for laplace
+        ax1: Optional axes to reuse for the deviation, a new figure is created and closed if not given.
+        ax2: Twin axes of ax1 to reuse for the iterations, needed if and only if ax1 is given.
     """
-    expected_result = kth_element(databases, k)
-    avg_deviation = []
-    avg_steps_needed = []
-
-    for i in range(0, resolution):
-        min_values = []
-        steps_needed = []
-        for _ in range(iterations_per_probability):
-            # Initialize CentralParty object
-            cp = CentralParty(databases, k, use_laplace=use_laplace, max_laplace_scale=laplace_scale)
-            # Find minimum
-            min_val, steps = cp.find_k(i / (resolution - 1))
-            min_values.append(min_val)
-            steps_needed.append(steps)
-
-        # Calculate average deviation and average steps
-        avg_deviation.append(np.mean(np.abs(np.array(min_values) - expected_result)))
-        avg_steps_needed.append(np.mean(steps_needed))
+    db_matrix = _as_db_matrix(databases)
+    expected_result = kth_element(db_matrix, k)
+
+    rng = np.random.default_rng()
+    # Steps of a binary search over [a, b], plus some slack for detours caused by the noise
+    a = int(db_matrix.min())
+    b = int(db_matrix.max())
+    max_steps = (b - a).bit_length() + 4
+
+    # Draw the noise for all probabilities and iterations at once
+    noise_probs = np.arange(resolution) / (resolution - 1)
+    noise_l, noise_g = sample_noise(rng, (resolution, iterations_per_probability, max_steps, len(databases)),
+                                    noise_probs[:, None, None, None], use_laplace, laplace_scale)
+    # Find minimum
+    min_values, steps_needed = run_sweep(db_matrix, k, a, b, noise_probs, laplace_scale, use_laplace,
+                                         noise_l, noise_g)
+
+    # Calculate average deviation and average steps for each probability
+    avg_deviation = mean_abs_deviation(min_values, expected_result)
+    avg_steps_needed = steps_needed.mean(axis=1)
 
     if use_laplace:
-        probabilities = [(i / resolution) * laplace_scale for i in range(0, resolution)]
+        probabilities = (np.arange(resolution) / resolution) * laplace_scale
     else:
-        probabilities = [(i / resolution) for i in range(0, resolution)]
-
-    # Creating a figure with two y-axes
-    fig, ax1 = plt.subplots()
+        probabilities = np.arange(resolution) / resolution
+
+    # Creating a figure with two y-axes, or clearing the given one
+    assert (ax1 is None) == (ax2 is None), "Pass both ax1 and its twin axes ax2, or neither"
+    own_figure = ax1 is None
+    if own_figure:
+        _, ax1 = plt.subplots()
+        ax2 = ax1.twinx()
+    else:
+        ax1.clear()
+        ax2.clear()
+        # Clearing moves the label of the twin axes back to the left
+        ax2.yaxis.set_label_position('right')
+    fig = ax1.figure
 
     if use_laplace:
-        plt.title(f"Laplace Noise, k = {k}")
+        ax1.set_title(f"Laplace Noise, k = {k}")
     else:
-        plt.title(f"Uniform Probability, k = {k}")
+        ax1.set_title(f"Uniform Probability, k = {k}")
 
     color = 'tab:red'
 
@@ -164,7 +387,6 @@ def plot_data(k, iterations_per_probability, resolution, databases, use_laplace,
     ax1.plot(probabilities, avg_deviation, color=color)
     ax1.tick_params(axis='y', labelcolor=color)
 
-    ax2 = ax1.twinx()
     color = 'tab:blue'
     ax2.set_ylabel('Average Iterations Needed', color=color)
     ax2.plot(probabilities, avg_steps_needed, color=color)
@@ -178,8 +400,9 @@ def plot_data(k, iterations_per_probability, resolution, databases, use_laplace,
     else:
         fig.savefig(f"k_{k}_uniform.png")
 
-    # Show the plot
-    plt.show()
+    # Nothing is shown, so a figure created here is not needed anymore
+    if own_figure:
+        plt.close(fig)
 
 
 def create_databases(amount, db_size, seed):
@@ -190,9 +413,9 @@ def create_databases(amount, db_size, seed):
     return databases
 
 
-def worker(k, databases, use_laplace):
+def worker(k, databases, use_laplace, ax1=None, ax2=None):
     plot_data(k=k, iterations_per_probability=1000, resolution=100, databases=databases, use_laplace=use_laplace,
-              laplace_scale=2)
+              laplace_scale=2, ax1=ax1, ax2=ax2)
 
 
 if __name__ == '__main__':
@@ -201,18 +424,17 @@ if __name__ == '__main__':
 
     # Databases will be the same for a fixed seed
     databases = create_databases(amount=PARTIES, db_size=DB_SIZE, seed="some_seed_to_fix_db")
+    # Stack the databases once, all plots share this read-only matrix
+    db_matrix = to_db_matrix(databases)
+    db_matrix.flags.writeable = False
 
     # We are looking for [min, med, max]
     k_values = [1, math.floor((PARTIES * DB_SIZE) / 2), PARTIES * DB_SIZE]
 
-    # The computation is done in parallel to get results faster (especially useful for large data sets)
-    jobs = []
+    # The plots are created one after another on the same figure, the runs of each plot are spread over all cores
+    fig, ax1 = plt.subplots()
+    ax2 = ax1.twinx()
     for use_laplace in [False, True]:
         for k in k_values:
-            process = multiprocessing.Process(target=worker, args=(k, databases, use_laplace,))
-            jobs.append(process)
-            process.start()
-
-    # Ensure all of the processes have finished
-    for job in jobs:
-        job.join()
+            worker(k, db_matrix, use_laplace, ax1, ax2)
+    plt.close(fig)
@@ -1,3 +1,4 @@
+import math
 import matplotlib.pyplot as plt
 import numpy as np
 import os
@@ -25,10 +26,11 @@ def plot_devi_histogram(input_filename: str, reference: str, output_filename: st
     """
 
     # Read the CSV file into a DataFrame
-    df = pd.read_csv(input_filename, header=None)
+    # Only the first column is used, single precision is enough for plotting
+    df = pd.read_csv(input_filename, header=None, usecols=[0], dtype=np.float32, engine='c')
 
     # Calculate percent deviation
-    deviation = ((df[0] - reference) / reference) * 100
+    deviation = ((df[0].to_numpy() - np.float32(reference)) / np.float32(reference)) * 100
 
     # Compute the mean absolute percent deviation
     mean_dev = np.mean(np.abs(deviation))
@@ -37,39 +39,17 @@ def plot_devi_histogram(input_filename: str, reference: str, output_filename: st
     min_width = 0.05
     width = max(plot_utils.freedman_diaconis(deviation), min_width)
 
-    # If there is no deviation, just plot a single bin & add extra bins for margin
+    # Bins of length width are centered around zero, bin n covers [(n-1/2)*width ... (n+1/2)*width]
+    # and the bin edges are given by the indices of the lowest and highest edge
     if mean_dev == 0:
+        # If there is no deviation, just plot a single bin & add extra bins for margin
         width = min_width
-        # Calculate a bin that covers [-1/2*width ... 1/2*width]
-        min_value = -0.5 * width
-        max_value = 0.5 * width
-        bins = [min_value, max_value]
-
-        for i in range(1, 8):
-            max_value += width
-            bins.append(max_value)
-            min_value -= width
-            bins = [min_value] + bins
-
+        lowest_edge, highest_edge = -8, 7
     else:
-        # Calculate a bin that covers [-1/2*width ... 1/2*width]
-        min_value = -0.5 * width
-        max_value = 0.5 * width
-        bins = [min_value, max_value]
-
-        # Add bins of length width in positive direction until the biggest value is captured
-        while True:
-            max_value += width
-            bins.append(max_value)
-            if not max_value < deviation.max():
-                break
-
-        # Add bins in negative direction until the smallest value is captured
-        while True:
-            min_value -= width
-            bins = [min_value] + bins
-            if not min_value > deviation.min():
-                break
+        # Add bins in both directions until the smallest and biggest value are captured (at least one per side)
+        lowest_edge = min(math.floor(deviation.min() / width - 0.5), -2)
+        highest_edge = max(math.ceil(deviation.max() / width - 0.5), 1)
+    bins = (np.arange(lowest_edge, highest_edge + 1) + 0.5) * width
 
     # Plot histogram
     plt.hist(deviation, bins=bins, edgecolor='black')
@@ -1,4 +1,5 @@
 import matplotlib.pyplot as plt
+import numpy as np
 import os
 import pandas as pd
 import sys
@@ -22,7 +23,8 @@ def plot_noise_histogram(input_filename: str, output_filename: str, title: str,
     """
 
     # Read the CSV file into a DataFrame
-    df = pd.read_csv(input_filename, header=None)
+    # Only the first column is used, single precision is enough for plotting
+    df = pd.read_csv(input_filename, header=None, usecols=[0], dtype=np.float32, engine='c')
 
     # Remove outliers
     clean_data = plot_utils.remove_outliers(df[0])
@@ -1,8 +1,8 @@
 import matplotlib.pyplot as plt
+import numpy as np
 import os
 import pandas as pd
 import sys
-from collections import Counter
 from matplotlib.colors import LinearSegmentedColormap
 from matplotlib.ticker import MaxNLocator
 
@@ -27,25 +27,17 @@ def plot_scatter(input_filename: str, output_filename: str, ref_value: float, ti
     # Read the CSV file into a DataFrame
     df = pd.read_csv(input_filename, header=None)
 
-    # Initialize variables
-    x_values = []
-    y_values = []
-    sizes = []
-
-    # Iterate over each row in the DataFrame
-    for index, row in df.iterrows():
-        # Skip empty lines
-        if row.isnull().all():
-            continue
-
-        # Get the counts of each x-value in the row
-        row_counts = Counter(row)
-
-        # Loop through each unique value and its count in the row
-        for value, count in row_counts.items():
-            x_values.append(value)
-            y_values.append(index)
-            sizes.append(count)  # Adjusted size
+    # Pair each value with the index of its row, skipping empty cells
+    values = df.to_numpy(dtype=float)
+    row_indices = np.repeat(np.arange(values.shape[0]), values.shape[1])
+    values = values.ravel()
+    mask = ~np.isnan(values)
+    pairs = np.column_stack((row_indices[mask], values[mask]))
+
+    # Get the counts of each x-value per row
+    unique_pairs, sizes = np.unique(pairs, axis=0, return_counts=True)
+    y_values = unique_pairs[:, 0]
+    x_values = unique_pairs[:, 1]
 
     # Create a color map from light blue to red
     colors = ["lightblue", "red"]